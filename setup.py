@@ -43,7 +43,14 @@ setup(
     ],
     install_requires=[
         "outpost.django",
+        "orjson",
+        "pybase64",
     ],
+    extras_require={
+        "uvloop": [
+            "uvloop",
+        ],
+    },
     packages=find_namespace_packages(
         where="src",
         include=[
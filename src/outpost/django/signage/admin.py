@@ -1,13 +1,34 @@
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
+from functools import lru_cache
+
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
 from django.contrib.admin.widgets import AdminSplitDateTime
+from django.contrib.contenttypes.models import ContentType
 from django.contrib.postgres.forms.ranges import RangeWidget
-from django.urls import reverse
-from django.utils import timezone
-from django.utils.html import format_html
+from django.db.models import (
+    CharField,
+    Exists,
+    F,
+    OuterRef,
+    Q,
+)
+from django.db.models.functions import Cast
+from django.urls import (
+    get_script_prefix,
+    reverse,
+)
+from django.utils import (
+    timezone,
+    translation,
+)
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
 from django.utils.translation import gettext_lazy as _
-from guardian.shortcuts import get_objects_for_user
+from django.utils.translation import ngettext
+from guardian.models import (
+    GroupObjectPermission,
+    UserObjectPermission,
+)
 from ordered_model.admin import (
     OrderedInlineModelAdminMixin,
     OrderedTabularInline,
@@ -30,10 +51,70 @@ from . import (
 )
 from .conf import settings
 
+_PK_PLACEHOLDER = 2147483647
+
+
+@lru_cache(maxsize=None)
+def _pk_url_template(viewname):
+    url = reverse(viewname, args=(_PK_PLACEHOLDER,))
+    return url[len(get_script_prefix()) :].replace(str(_PK_PLACEHOLDER), "{pk}")
+
+
+def _pk_url(viewname, pk):
+    return get_script_prefix() + _pk_url_template(viewname).format(pk=pk)
+
+
+@lru_cache(maxsize=8)
+def _sorted_by_verbose_name(classes, language):
+    return tuple(sorted(classes, key=lambda c: str(c._meta.verbose_name)))
+
+
+def _safe_link(url, label):
+    return mark_safe(f"<a href='{url}'>{escape(label)}</a>")
+
+
+def _guarded_queryset(request, perm, qs):
+    if request.user.has_perm(perm):
+        return qs
+    codename = perm.split(".", 1)[-1]
+    filters = {
+        "content_type": ContentType.objects.get_for_model(qs.model),
+        "object_pk": Cast(OuterRef("pk"), CharField()),
+        "permission__codename": codename,
+    }
+    return qs.annotate(
+        user_permitted=Exists(
+            UserObjectPermission.objects.filter(user=request.user, **filters)
+        ),
+        group_permitted=Exists(
+            GroupObjectPermission.objects.filter(group__user=request.user, **filters)
+        ),
+    ).filter(Q(user_permitted=True) | Q(group_permitted=True))
+
 
 @admin.register(models.Resolution)
 class ResolutionAdmin(admin.ModelAdmin):
     list_display = ("pk", "width", "height", "dpi", "scale")
+    search_fields = ("width", "height")
+    show_full_result_count = False
+
+
+class DisplayChangeList(ChangeList):
+    """
+    Only the changelist columns need the link labels and the items used to
+    resolve the current power state and playlist.
+    """
+
+    def get_queryset(self, request):
+        return (
+            super()
+            .get_queryset(request)
+            .annotate(schedule_name=F("schedule__name"), power_name=F("power__name"))
+            .prefetch_related(
+                "schedule__scheduleitem_set__playlist",
+                "power__poweritem_set",
+            )
+        )
 
 
 @admin.register(models.Display)
@@ -57,30 +138,59 @@ class DisplayAdmin(
         "power_state",
         "playlist_state",
     )
-    list_filter = ("schedule", "power", "resolution", "enabled", "online")
+    list_filter = (
+        ("schedule", admin.RelatedOnlyFieldListFilter),
+        ("power", admin.RelatedOnlyFieldListFilter),
+        ("resolution", admin.RelatedOnlyFieldListFilter),
+        "enabled",
+        "online",
+    )
+    list_select_related = ("schedule", "power", "room", "resolution")
     readonly_fields = ("pk", "config", "screenshot")
+    autocomplete_fields = ("resolution",)
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return (
+            super()
+            .get_queryset(request)
+            .select_related("schedule", "power", "room", "resolution")
+        )
+
+    def get_changelist(self, request, **kwargs):
+        return DisplayChangeList
+
+    def get_changelist_instance(self, request):
+        cl = super().get_changelist_instance(request)
+        now = timezone.now()
+        for obj in cl.result_list:
+            obj._now = now
+        return cl
 
     def get_form(self, request, obj=None, **kwargs):
         form = super().get_form(request, obj, **kwargs)
-        form.base_fields["schedule"].queryset = get_objects_for_user(
-            request.user, "signage.view_schedule", form.base_fields["schedule"].queryset
-        )
+        if "schedule" in form.base_fields:
+            form.base_fields["schedule"].queryset = _guarded_queryset(
+                request,
+                "signage.view_schedule",
+                form.base_fields["schedule"].queryset.only("pk", "name"),
+            )
         return form
 
     def schedule_link(self, obj):
-        if not obj.schedule:
+        if not obj.schedule_id:
             return "-"
-        url = reverse("admin:signage_schedule_change", args=(obj.schedule.pk,))
-        return format_html("<a href='{}'>{}</a>", url, obj.schedule)
+        url = _pk_url("admin:signage_schedule_change", obj.schedule_id)
+        return _safe_link(url, obj.schedule_name)
 
     schedule_link.admin_order_field = "schedule"
     schedule_link.short_description = _("Schedule")
 
     def power_link(self, obj):
-        if not obj.power:
+        if not obj.power_id:
             return "-"
-        url = reverse("admin:signage_power_change", args=(obj.power.pk,))
-        return format_html("<a href='{}'>{}</a>", url, obj.power)
+        url = _pk_url("admin:signage_power_change", obj.power_id)
+        return _safe_link(url, obj.power_name)
 
     power_link.admin_order_field = "power"
     power_link.short_description = _("Power")
@@ -88,7 +198,7 @@ class DisplayAdmin(
     def power_state(self, obj):
         if not obj.power:
             return False
-        return obj.power.get_active_state(timezone.now())
+        return obj.power.get_active_state(getattr(obj, "_now", None) or timezone.now())
 
     power_state.short_description = _("Power state")
     power_state.boolean = True
@@ -96,15 +206,18 @@ class DisplayAdmin(
     def playlist_state(self, obj):
         if not obj.schedule:
             return "-"
-        return obj.schedule.get_active_playlist(timezone.now())
+        return obj.schedule.get_active_playlist(
+            getattr(obj, "_now", None) or timezone.now()
+        )
 
     playlist_state.short_description = _("Playlist state")
 
     def screenshot(self, obj):
-        if obj.screenshot:
-            return format_html(
-                """<img style="max-width: 50%" class="submit-row" src="{}"/>""",
-                reverse("signage:display-screenshot", kwargs={"pk": obj.pk}),
+        if obj.has_screenshot():
+            url = _pk_url("signage:display-screenshot", obj.pk)
+            thumbnail = _pk_url("signage:display-screenshot-thumbnail", obj.pk)
+            return mark_safe(
+                f"""<a href="{url}"><img style="max-width: 50%" class="submit-row" src="{thumbnail}"/></a>"""
             )
         return "-"
 
@@ -120,6 +233,15 @@ class PageChildAdmin(
 ):
     base_model = models.Page
     object_permissions = ("view", "change", "delete")
+    queryset_filters = {}
+
+    def get_form(self, request, obj=None, **kwargs):
+        form = super().get_form(request, obj, **kwargs)
+        for name, func in self.queryset_filters.items():
+            if name in form.base_fields:
+                field = form.base_fields[name]
+                field.queryset = func(field.queryset, request)
+        return form
 
 
 @admin.register(models.Page)
@@ -130,25 +252,36 @@ class PageParentAdmin(
     PolymorphicParentModelAdmin,
 ):
     base_model = models.Page
-    child_models = sorted(
-        (
-            models.WeatherPage,
-            models.HTMLPage,
-            models.RichTextPage,
-            models.ImagePage,
-            models.VideoPage,
-            models.WebsitePage,
-            models.PDFPage,
-            models.LiveChannelPage,
-            models.TYPO3NewsPage,
-            models.TYPO3EventPage,
-            models.CampusOnlineEventPage,
-            models.RestaurantPage,
-        ),
-        key=lambda c: c._meta.verbose_name,
+    child_models = (
+        models.WeatherPage,
+        models.HTMLPage,
+        models.RichTextPage,
+        models.ImagePage,
+        models.VideoPage,
+        models.WebsitePage,
+        models.PDFPage,
+        models.LiveChannelPage,
+        models.TYPO3NewsPage,
+        models.TYPO3EventPage,
+        models.CampusOnlineEventPage,
+        models.RestaurantPage,
     )
     list_filter = (PolymorphicChildModelFilter,)
     list_display = ("name", "page", "created", "modified")
+    list_select_related = ("polymorphic_ctype",)
+    search_fields = ("name",)
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return (
+            super()
+            .get_queryset(request)
+            .non_polymorphic()
+            .select_related("polymorphic_ctype")
+        )
+
+    def get_child_models(self):
+        return _sorted_by_verbose_name(self.child_models, translation.get_language())
 
 
 @admin.register(models.WeatherPage)
@@ -211,26 +344,22 @@ class LiveChannelPageAdmin(PageChildAdmin):
 class TYPO3NewsPageAdmin(PageChildAdmin):
     base_model = models.TYPO3NewsPage
     show_in_index = False
-
-    def get_form(self, request, obj=None, **kwargs):
-        form = super().get_form(request, obj, **kwargs)
-        form.base_fields["news"].queryset = form.base_fields["news"].queryset.filter(
+    queryset_filters = {
+        "news": lambda qs, request: qs.filter(
             datetime__gte=timezone.now() - settings.SIGNAGE_TYPO3_NEWS_RETROSPECTIVE
-        )
-        return form
+        ).defer("teaser", "body"),
+    }
 
 
 @admin.register(models.TYPO3EventPage)
 class TYPO3EventPageAdmin(PageChildAdmin):
     base_model = models.TYPO3EventPage
     show_in_index = False
-
-    def get_form(self, request, obj=None, **kwargs):
-        form = super().get_form(request, obj, **kwargs)
-        form.base_fields["event"].queryset = form.base_fields["event"].queryset.filter(
+    queryset_filters = {
+        "event": lambda qs, request: qs.filter(
             start__gte=timezone.now() - settings.SIGNAGE_TYPO3_NEWS_RETROSPECTIVE
-        )
-        return form
+        ).defer("teaser", "body"),
+    }
 
 
 @admin.register(models.RestaurantPage)
@@ -238,13 +367,9 @@ class RestaurantPageAdmin(PageChildAdmin):
     base_model = models.RestaurantPage
     show_in_index = False
     exclude = ("runtime",)
-
-    def get_form(self, request, obj=None, **kwargs):
-        form = super().get_form(request, obj, **kwargs)
-        form.base_fields["restaurants"].queryset = form.base_fields[
-            "restaurants"
-        ].queryset.filter(enabled=True)
-        return form
+    queryset_filters = {
+        "restaurants": lambda qs, request: qs.filter(enabled=True),
+    }
 
 
 class PlaylistItemInline(GuardedModelAdminPermissionMixin, OrderedTabularInline):
@@ -261,14 +386,23 @@ class PlaylistItemInline(GuardedModelAdminPermissionMixin, OrderedTabularInline)
     ordering = ("order",)
     extra = 1
 
-    def get_formset(self, request, obj=None, **kwargs):
-        formset = super().get_formset(request, obj, **kwargs)
-        formset.form.base_fields.get("page").queryset = get_objects_for_user(
-            request.user,
-            "signage.view_page",
-            formset.form.base_fields.get("page").queryset,
+    def get_queryset(self, request):
+        return (
+            super()
+            .get_queryset(request)
+            .select_related("page", "page__polymorphic_ctype")
         )
-        return formset
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == "page":
+            kwargs["queryset"] = _guarded_queryset(
+                request,
+                "signage.view_page",
+                models.Page.objects.non_polymorphic()
+                .select_related("polymorphic_ctype")
+                .only("pk", "name", "modified", "polymorphic_ctype"),
+            )
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
 
 @admin.register(models.Playlist)
@@ -281,6 +415,8 @@ class PlaylistAdmin(
     admin.ModelAdmin,
 ):
     inlines = (PlaylistItemInline,)
+    search_fields = ("name",)
+    show_full_result_count = False
     object_permissions = ("view", "change", "delete")
     related_object_permissions = {
         models.PlaylistItem: ("view", "change", "delete"),
@@ -293,14 +429,17 @@ class ScheduleItemInline(GuardedModelAdminPermissionMixin, OrderedTabularInline)
     form = forms.ScheduleItemAdminForm
     formset = forms.ScheduleItemAdminInlineFormSet
 
-    def get_formset(self, request, obj=None, **kwargs):
-        formset = super().get_formset(request, obj, **kwargs)
-        formset.form.base_fields.get("playlist").queryset = get_objects_for_user(
-            request.user,
-            "signage.view_playlist",
-            formset.form.base_fields.get("playlist").queryset,
-        )
-        return formset
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("playlist")
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == "playlist":
+            kwargs["queryset"] = _guarded_queryset(
+                request,
+                "signage.view_playlist",
+                models.Playlist.objects.only("pk", "name"),
+            )
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
 
 @admin.register(models.Schedule)
@@ -314,6 +453,9 @@ class ScheduleAdmin(
 ):
     inlines = (ScheduleItemInline,)
     list_display = ("name", "default", "ical")
+    list_select_related = ("default",)
+    search_fields = ("name",)
+    show_full_result_count = False
     actions = ("publish",)
     object_permissions = ("view", "change", "delete")
     related_object_permissions = {
@@ -322,23 +464,31 @@ class ScheduleAdmin(
 
     def get_form(self, request, obj=None, **kwargs):
         form = super().get_form(request, obj, **kwargs)
-        form.base_fields["default"].queryset = get_objects_for_user(
-            request.user, "signage.view_playlist", form.base_fields["default"].queryset
-        )
+        if "default" in form.base_fields:
+            form.base_fields["default"].queryset = _guarded_queryset(
+                request,
+                "signage.view_playlist",
+                form.base_fields["default"].queryset.only("pk", "name"),
+            )
         return form
 
     def ical(self, obj):
-        return format_html(
-            _("""<a href="{}">Download</a>"""),
-            reverse("signage:ical-schedule", kwargs={"pk": obj.pk}),
-        )
+        url = escape(_pk_url("signage:ical-schedule", obj.pk))
+        return mark_safe(_("""<a href="{}">Download</a>""").format(url))
 
     ical.short_description = _("Calendar")
 
     def publish(self, request, queryset):
-        for s in queryset.all():
-            s.publish()
-            self.message_user(request, _("{s} successfully published.").format(s=s))
+        count = models.Schedule.bulk_publish(queryset)
+        self.message_user(
+            request,
+            ngettext(
+                "%(count)d schedule successfully published.",
+                "%(count)d schedules successfully published.",
+                count,
+            )
+            % {"count": count},
+        )
 
     publish.short_description = _("Publish schedule to connected displays")
 
@@ -361,6 +511,8 @@ class PowerAdmin(
     admin.ModelAdmin,
 ):
     inlines = (PowerItemInline,)
+    search_fields = ("name",)
+    show_full_result_count = False
     actions = ("publish",)
     object_permissions = ("view", "change", "delete")
     related_object_permissions = {
@@ -369,17 +521,29 @@ class PowerAdmin(
 
     def save_related(self, request, form, formsets, change):
         super().save_related(request, form, formsets, change)
-        # import pudb; pu.db
+        if change and not any(f.has_changed() for f in (form, *formsets)):
+            return
         now = timezone.now()
-        channel_layer = get_channel_layer()
-        msg_type = "power.on" if form.instance.get_active_state(now) else "power.off"
-        async_to_sync(channel_layer.group_send)(
-            form.instance.channel, {"type": msg_type}
-        )
+        poweritems = None
+        for formset in formsets:
+            if formset.model is models.PowerItem:
+                poweritems = [
+                    f.instance for f in formset.forms if f.instance.pk is not None
+                ]
+        state = form.instance.get_active_state(now, poweritems=poweritems)
+        msg_type = "power.on" if state else "power.off"
+        models.send_many(((form.instance.channel, {"type": msg_type}),), group=True)
 
     def publish(self, request, queryset):
-        for p in queryset.all():
-            p.publish()
-            self.message_user(request, _("{p} successfully published.").format(p=p))
+        count = models.Power.bulk_publish(queryset)
+        self.message_user(
+            request,
+            ngettext(
+                "%(count)d power successfully published.",
+                "%(count)d powers successfully published.",
+                count,
+            )
+            % {"count": count},
+        )
 
     publish.short_description = _("Publish power to connected displays")
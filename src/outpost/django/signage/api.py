@@ -16,15 +16,13 @@ class PlaylistViewSet(FlexFieldsMixin, ReadOnlyModelViewSet):
     serializer_class = serializers.PlaylistSerializer
     permission_classes = (ExtendedDjangoObjectPermissions,)
     filter_fields = ()
+    permissions = ("signage.view_playlist", "signage.change_playlist")
 
     def get_queryset(self):
-        qs = super().get_queryset()
-        view = f"{qs.model._meta.app_label}.view_{qs.model._meta.model_name}"
-        change = f"{qs.model._meta.app_label}.change_{qs.model._meta.model_name}"
         return get_objects_for_user(
             self.request.user,
-            (view, change),
-            qs,
+            self.permissions,
+            super().get_queryset(),
             accept_global_perms=True,
             any_perm=True,
         )
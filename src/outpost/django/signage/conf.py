@@ -1,25 +1,39 @@
 from datetime import timedelta
 
 from appconf import AppConf
-from apscheduler.jobstores.memory import MemoryJobStore
 from django.conf import settings
 
 
 class SignageAppConf(AppConf):
-    SCHEDULER_JOB_STORES = {
-        "default": MemoryJobStore(),
-    }
+    SCHEDULER_JOB_STORES = {}
     SCHEDULER_START = "SIGNAGE_SCHEDULER_START"
     SCHEDULER_CHANNEL = "signage-scheduler"
+    SCHEDULER_BATCH_SIZE = 100
+    SCHEDULER_BATCH_WINDOW = timedelta(milliseconds=50)
+    SCHEDULER_DB_WORKERS = 4
+    SCHEDULER_SEND_WINDOW = timedelta(milliseconds=10)
+    SCHEDULER_UVLOOP = True
     TYPO3_NEWS_RETROSPECTIVE = timedelta(days=365)
     TYPO3_EVENT_RETROSPECTIVE = timedelta(days=31)
     PDF_RENDER_MIN_WIDTH = 3840
     PDF_RENDER_MIN_HEIGHT = 2160
     PDF_RENDER_FORMAT = "webp"
     PDF_RENDER_QUALITY = 70
+    DISPLAY_KEY_ALGORITHM = "ssh-ed25519"
     DISPLAY_SCREEN_KEY = "{self.__class__.__module__}.{self.__class__.__name__}:screen:{self.pk}"
     DISPLAY_SCREEN_LIFETIME = timedelta(minutes=5)
+    DISPLAY_SCREEN_TOKEN_KEY = "{self.__class__.__module__}.{self.__class__.__name__}:screen:{self.pk}:token"
+    DISPLAY_SCREEN_THUMBNAIL_KEY = "{self.__class__.__module__}.{self.__class__.__name__}:screen:{self.pk}:thumb"
+    DISPLAY_SCREEN_THUMBNAIL_SIZE = (320, 180)
+    DISPLAY_SCREEN_THUMBNAIL_QUALITY = 70
     DISPLAY_SCREEN_EMPTY = "signage/screenshot/empty.png"
+    PAGE_MESSAGE_KEY = "outpost.django.signage.models.Page:message:{self.pk}:{self.modified:%Y%m%dT%H%M%S.%f}"
+    PAGE_MESSAGE_LIFETIME = timedelta(minutes=1)
+    PLAYLIST_MESSAGE_KEY = "{self.__class__.__module__}.{self.__class__.__name__}:message:{self.pk}"
+    PLAYLIST_MESSAGE_LIFETIME = timedelta(minutes=1)
+    SCHEDULE_PLAYLIST_KEY = "{self.__class__.__module__}.{self.__class__.__name__}:playlist:{self.pk}"
+    SCHEDULE_PLAYLIST_LIFETIME = timedelta(hours=1)
+    ORJSON = True
 
     class Meta:
         prefix = "signage"
@@ -1,128 +1,198 @@
 import json
 import logging
-from base64 import b64decode
-from io import BytesIO
+from functools import lru_cache
 
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import JsonWebsocketConsumer
+import orjson
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
-from PIL import Image
+from pybase64 import b64decode
 
 from . import (
     models,
     schemas,
 )
+from .conf import settings
 
 logger = logging.getLogger(__name__)
 
+IMAGE_SIGNATURES = {
+    b"\x89PNG\r\n\x1a\n": "PNG",
+    b"\xff\xd8\xff": "JPEG",
+    b"RIFF": "WEBP",
+}
 
-class FrontendConsumer(JsonWebsocketConsumer):
-    def connect(self):
+
+def image_format(data):
+    for signature, format in IMAGE_SIGNATURES.items():
+        if data.startswith(signature):
+            # RIFF is a generic container, only accept WebP payloads
+            if signature == b"RIFF" and data[8:12] != b"WEBP":
+                return None
+            return format
+    return None
+
+
+# Dates and times are passed through to DjangoJSONEncoder as well, so orjson
+# output keeps its millisecond precision and "Z" suffix.
+_orjson_default = DjangoJSONEncoder().default
+
+
+def encode_message(content):
+    if settings.SIGNAGE_ORJSON:
+        return orjson.dumps(
+            content,
+            default=_orjson_default,
+            option=orjson.OPT_PASSTHROUGH_DATETIME,
+        ).decode("utf-8")
+    return json.dumps(content, cls=DjangoJSONEncoder)
+
+
+@lru_cache(maxsize=32)
+def encode_power_message(power, scale):
+    return encode_message(schemas.PowerMessage(power=power, scale=scale).dict())
+
+
+class FrontendConsumer(AsyncJsonWebsocketConsumer):
+    def sync_connect(self, pk):
+        display = (
+            models.Display.objects.select_related("schedule")
+            .only("pk", "enabled", "schedule")
+            .get(pk=pk)
+        )
+        if not display.enabled:
+            return display, None
+        display.connected = timezone.now()
+        models.Display.objects.filter(pk=display.pk).update(connected=display.connected)
+        if not display.schedule:
+            return display, None
+        playlist = display.schedule.get_cached_playlist(timezone.now())
+        return display, playlist.get_cached_message()
+
+    async def connect(self):
         try:
-            self.display = models.Display.objects.get(
-                pk=self.scope["url_route"]["kwargs"]["pk"]
+            self.display, message = await database_sync_to_async(self.sync_connect)(
+                self.scope["url_route"]["kwargs"]["pk"]
             )
         except models.Display.DoesNotExist:
-            self.close()
+            await self.close()
             return
         if not self.display.enabled:
-            self.close()
+            await self.close()
             return
 
-        self.display.connected = timezone.now()
-        self.display.save()
-
-        self.accept()
+        await self.accept()
 
         if self.display.schedule:
-            async_to_sync(self.channel_layer.group_add)(
+            await self.channel_layer.group_add(
                 self.display.schedule.channel, self.channel_name
             )
-        self.send_json(
-            self.display.schedule.get_active_playlist(timezone.now())
-            .get_message()
-            .dict()
-        )
+            await self.send_json(message)
 
-    def receive(self, text_data=None, bytes_data=None, **kwargs):
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
         return
 
-    def disconnect(self, close_code):
+    async def disconnect(self, close_code):
+        if not hasattr(self, "display"):
+            return
         if self.display.schedule:
-            async_to_sync(self.channel_layer.group_discard)(
+            await self.channel_layer.group_discard(
                 self.display.schedule.channel, self.channel_name
             )
         self.display.connected = None
-        self.display.save(update_fields=["connected"])
+        await database_sync_to_async(
+            models.Display.objects.filter(pk=self.display.pk).update
+        )(connected=None)
 
-    def playlist_update(self, message):
+    def sync_playlist_update(self, pk):
         try:
-            playlist = models.Playlist.objects.get(pk=message.get("playlist"))
+            playlist = models.Playlist.objects.get(pk=pk)
         except models.Playlist.DoesNotExist:
+            return None
+        return playlist.get_cached_message()
+
+    async def playlist_update(self, message):
+        if (payload := message.get("payload")) is not None:
+            await self.send(text_data=payload)
             return
-        self.send_json(playlist.get_message().dict())
+        content = await database_sync_to_async(self.sync_playlist_update)(
+            message.get("playlist")
+        )
+        if content is None:
+            return
+        await self.send_json(content)
 
     @classmethod
-    def encode_json(cls, content):
-        return json.dumps(content, cls=DjangoJSONEncoder)
+    async def encode_json(cls, content):
+        return encode_message(content)
+
 
+class DisplayConsumer(AsyncJsonWebsocketConsumer):
+    def sync_connect(self, pk):
+        display = (
+            models.Display.objects.select_related("power", "resolution")
+            .defer("config")
+            .get(pk=pk)
+        )
+        if not display.enabled or not display.power:
+            return display, True
+        return display, display.power.get_active_state(timezone.now())
 
-class DisplayConsumer(JsonWebsocketConsumer):
-    def connect(self):
+    async def connect(self):
         try:
-            self.display = models.Display.objects.get(
-                pk=self.scope["url_route"]["kwargs"]["pk"]
+            self.display, power = await database_sync_to_async(self.sync_connect)(
+                self.scope["url_route"]["kwargs"]["pk"]
             )
         except models.Display.DoesNotExist:
-            self.close()
+            await self.close()
             return
         if not self.display.enabled:
-            self.close()
+            await self.close()
             return
 
-        self.accept()
-        if not self.display.power:
-            self.send_json(
-                schemas.PowerMessage(
-                    power=True, scale=self.display.resolution.scale
-                ).dict()
+        await self.accept()
+        self.payloads = {
+            state: encode_power_message(state, self.display.resolution.scale)
+            for state in (True, False)
+        }
+        if self.display.power:
+            await self.channel_layer.group_add(
+                self.display.power.channel, self.channel_name
             )
-            return
-        async_to_sync(self.channel_layer.group_add)(
-            self.display.power.channel, self.channel_name
-        )
-        self.send_json(
-            schemas.PowerMessage(
-                power=self.display.power.get_active_state(timezone.now()),
-                scale=self.display.resolution.scale,
-            ).dict()
-        )
+        await self.send(text_data=self.payloads[power])
 
-    def disconnect(self, close_code):
+    async def disconnect(self, close_code):
+        if not hasattr(self, "display"):
+            return
         if self.display.power:
-            async_to_sync(self.channel_layer.group_discard)(
+            await self.channel_layer.group_discard(
                 self.display.power.channel, self.channel_name
             )
 
-    def receive_json(self, content):
+    def sync_receive_json(self, content):
         self.display.config = content.get("config")
         if (screen := content.get("screen")):
             try:
-                self.display.screenshot = Image.open(BytesIO(b64decode(screen)))
-            except Exception:
-                logger.warn(f"Could not decode screenshot from display {self.display}")
+                data = b64decode(screen, validate=True)
+            except ValueError:
+                data = b""
+            if (format := image_format(data)):
+                self.display.cache_screenshot(data, format)
+            else:
+                logger.warn("Could not decode screenshot from display %s", self.display)
                 del self.display.screenshot
         self.display.save(update_fields=["config"])
 
-    def power_on(self, *args):
-        self.send_json(
-            schemas.PowerMessage(power=True, scale=self.display.resolution.scale).dict()
-        )
+    async def receive_json(self, content):
+        await database_sync_to_async(self.sync_receive_json)(content)
 
-    def power_off(self, *args):
-        self.send_json(
-            schemas.PowerMessage(
-                power=False, scale=self.display.resolution.scale
-            ).dict()
-        )
+    async def power_on(self, *args):
+        await self.send(text_data=self.payloads[True])
+
+    async def power_off(self, *args):
+        await self.send(text_data=self.payloads[False])
+
+    @classmethod
+    async def encode_json(cls, content):
+        return encode_message(content)
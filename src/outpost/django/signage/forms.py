@@ -2,7 +2,7 @@ from datetime import (
     datetime,
     time,
 )
-from itertools import combinations
+from functools import lru_cache
 
 from django import forms
 from django.contrib.admin.widgets import AdminSplitDateTime
@@ -36,39 +36,48 @@ class ScheduleItemAdminInlineFormSet(forms.BaseInlineFormSet):
         def overlap(x1, x2, y1, y2):
             return max(x1, y1) <= min(x2, y2)
 
-        def recurrences(r, start, stop):
-            return set(
-                [
-                    t.date()
-                    for t in r.between(
-                        start,
-                        stop,
-                        inc=True,
-                        dtstart=datetime.combine(
-                            start.date(), time(), tzinfo=start.tzinfo
-                        ),
-                    )
-                ]
+        @lru_cache(maxsize=None)
+        def recurrences(form, start, stop):
+            # Both sides of a comparison are expanded from the same dtstart so
+            # interval rules line up the way they are evaluated at runtime.
+            return frozenset(
+                t.date()
+                for t in form.instance.recurrences.between(
+                    start,
+                    stop,
+                    inc=True,
+                    dtstart=datetime.combine(start.date(), time(), tzinfo=start.tzinfo),
+                )
             )
 
-        for a, b in combinations(filter(lambda f: f.has_changed(), self.forms), 2):
-            if not overlap(
-                a.instance.range.lower,
-                a.instance.range.upper,
-                b.instance.range.lower,
-                b.instance.range.upper,
-            ):
-                continue
-            if not overlap(
-                a.instance.start, a.instance.stop, b.instance.start, b.instance.stop
-            ):
-                continue
-            start = max(a.instance.range.lower, b.instance.range.lower)
-            stop = min(a.instance.range.upper, b.instance.range.upper)
-            if recurrences(a.instance.recurrences, start, stop) & recurrences(
-                b.instance.recurrences, start, stop
-            ):
-                a.add_error(
-                    None,
-                    _("{scheduleitem} would overlap").format(scheduleitem=b.instance),
-                )
+        changed = sorted(
+            filter(lambda f: f.has_changed(), self.forms),
+            key=lambda f: f.instance.range.lower,
+        )
+        active = []
+        for form in changed:
+            active = [
+                f for f in active if f.instance.range.upper >= form.instance.range.lower
+            ]
+            for other in active:
+                if not overlap(
+                    other.instance.start,
+                    other.instance.stop,
+                    form.instance.start,
+                    form.instance.stop,
+                ):
+                    continue
+                # Sorted by lower bound, so this is where both ranges start
+                start = form.instance.range.lower
+                stop = min(other.instance.range.upper, form.instance.range.upper)
+                if not recurrences(other, start, stop).isdisjoint(
+                    recurrences(form, start, stop)
+                ):
+                    a, b = sorted((other, form), key=self.forms.index)
+                    a.add_error(
+                        None,
+                        _("{scheduleitem} would overlap").format(
+                            scheduleitem=b.instance
+                        ),
+                    )
+            active.append(form)
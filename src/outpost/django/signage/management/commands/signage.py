@@ -1,31 +1,58 @@
 import asyncio
 import inspect
 import logging
+import signal
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
+from apscheduler.jobstores.base import JobLookupError
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from asgiref.server import StatelessServer
-from channels.db import database_sync_to_async
 from channels.layers import get_channel_layer
 from channels.routing import get_default_application
 from django.core.management.base import (
     BaseCommand,
     CommandError,
 )
+from django.db import close_old_connections
 from django.utils import timezone
 
 from ... import models
 from ...conf import settings
+from ...consumers import encode_message
 
 logger = logging.getLogger(__name__)
 
+POWER_MESSAGES = {
+    True: {"type": "power.on"},
+    False: {"type": "power.off"},
+}
 
-def get_model_objects(model, filters=None):
+
+def get_model_objects(model, filters=None, select=None, prefetch=None):
     qs = model.objects.all()
     if filters:
         qs = qs.filter(**filters)
+    if select:
+        qs = qs.select_related(*select)
+    if prefetch:
+        qs = qs.prefetch_related(*prefetch)
     return list(qs)
 
 
+def get_schedules(filters=None):
+    return get_model_objects(
+        models.Schedule,
+        filters,
+        select=("default",),
+        prefetch=("scheduleitem_set__playlist",),
+    )
+
+
+def get_powers(filters=None):
+    return get_model_objects(models.Power, filters, prefetch=("poweritem_set",))
+
+
 class SignageServer(StatelessServer):
     def __init__(self, application, channel_layer, channel, max_applications=1000):
         super().__init__(application, max_applications)
@@ -33,6 +60,16 @@ class SignageServer(StatelessServer):
         if self.channel_layer is None:
             raise ValueError("Channel layer is not valid")
         self.channel = channel
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.SIGNAGE_SCHEDULER_DB_WORKERS,
+            thread_name_prefix="signage-db",
+        )
+        self.handlers = {
+            name.removeprefix("handle_"): getattr(self, name)
+            for name in dir(self)
+            if name.startswith("handle_")
+            and inspect.iscoroutinefunction(getattr(self, name))
+        }
         self.scheduler = AsyncIOScheduler(
             jobstores=settings.SIGNAGE_SCHEDULER_JOB_STORES,
             timezone=timezone.utc,
@@ -40,138 +77,246 @@ class SignageServer(StatelessServer):
                 "misfire_grace_time": 10,
             },
         )
-        self.scheduler.start()
+        self.pending_sends = dict()
+        self.flush_task = None
+        self.receive_task = None
         self.schedules = dict()
         self.powers = dict()
-        now = timezone.now()
-        for s in models.Schedule.objects.all():
+        now = timezone.localtime()
+        for s in get_schedules():
             trigger = s.get_next_trigger(now)
             if not trigger:
-                logger.info(f"No more scheduled items for {s}")
+                logger.info("No more scheduled items for %s", s)
                 if s.pk in self.schedules:
                     del self.schedules[s.pk]
                 continue
-            logger.debug(f"Updating schedule {s} at {trigger}")
+            logger.debug("Updating schedule %s at %s", s, trigger)
             self.schedules[s.pk] = self.scheduler.add_job(
-                self.schedule,
+                self.fire_schedule,
                 "date",
-                run_date=trigger.astimezone(timezone.utc),
-                kwargs={"schedule": s, "after": trigger},
+                run_date=trigger,
+                id=f"schedule:{s.pk}",
+                replace_existing=True,
+                kwargs={"pk": s.pk, "after": trigger},
             )
-        for p in models.Power.objects.all():
+        for p in get_powers():
             trigger = p.get_next_trigger(now)
             if not trigger:
-                logger.info(f"No more power items for {p}")
+                logger.info("No more power items for %s", p)
                 if p.pk in self.powers:
                     del self.powers[p.pk]
                 continue
-            logger.debug(f"Updating power {p} at {trigger}")
+            logger.debug("Updating power %s at %s", p, trigger)
             self.powers[p.pk] = self.scheduler.add_job(
-                self.power,
+                self.fire_power,
                 "date",
-                run_date=trigger.astimezone(timezone.utc),
-                kwargs={"power": p, "after": trigger},
+                run_date=trigger,
+                id=f"power:{p.pk}",
+                replace_existing=True,
+                kwargs={"pk": p.pk, "after": trigger},
             )
+        # Jobs added before start are committed under one lock and wakeup.
+        self.scheduler.start()
+
+    def run(self):
+        loop = asyncio.get_event_loop()
+        main = loop.create_task(self.handle())
+        loop.add_signal_handler(signal.SIGTERM, main.cancel)
+        asyncio.ensure_future(self.application_checker())
+        try:
+            loop.run_until_complete(main)
+        except KeyboardInterrupt:
+            logger.info("Exiting due to Ctrl-C/interrupt")
+        except asyncio.CancelledError:
+            logger.info("Exiting due to SIGTERM")
+        finally:
+            self.scheduler.shutdown(wait=False)
+            self.executor.shutdown(wait=False)
+
+    async def run_sync(self, func, *args, **kwargs):
+        def run():
+            close_old_connections()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                close_old_connections()
+
+        return await asyncio.get_running_loop().run_in_executor(self.executor, run)
+
+    def remove_job(self, job_id):
+        try:
+            self.scheduler.remove_job(job_id)
+        except JobLookupError:
+            pass
 
     def sync_schedule(self, schedule, after):
-        logger.debug(f"Updating schedule {schedule} after {after}")
+        logger.debug("Updating schedule %s after %s", schedule, after)
         trigger = schedule.get_next_trigger(after)
         if not trigger:
-            logger.info(f"No more events for {schedule} after {after}")
-            if schedule.pk in self.schedules:
-                del self.schedules[schedule.pk]
+            logger.info("No more events for %s after %s", schedule, after)
+            self.schedules.pop(schedule.pk, None)
+            self.remove_job(f"schedule:{schedule.pk}")
+            schedule.invalidate_playlist()
             return
-        logger.debug(f"Next update for schedule {schedule} at {trigger}")
+        logger.debug("Next update for schedule %s at %s", schedule, trigger)
         p = schedule.get_active_playlist(after)
-        logger.debug(f"Starting playlist {p} from {schedule}")
+        schedule.cache_playlist(p, until=trigger)
+        logger.debug("Starting playlist %s from %s", p, schedule)
         self.schedules[schedule.pk] = self.scheduler.add_job(
-            self.schedule,
+            self.fire_schedule,
             "date",
-            run_date=trigger.astimezone(timezone.utc),
-            kwargs={"schedule": schedule, "after": trigger},
+            run_date=trigger,
+            id=f"schedule:{schedule.pk}",
+            replace_existing=True,
+            kwargs={"pk": schedule.pk, "after": trigger},
         )
         return p
 
+    async def fire_schedule(self, pk, after):
+        for schedule in await self.run_sync(get_schedules, {"pk": pk}):
+            await self.schedule(schedule, after)
+
     async def schedule(self, schedule, after):
-        p = await database_sync_to_async(self.sync_schedule)(schedule, after)
+        p = await self.run_sync(self.sync_schedule, schedule, after)
         if p is None:
             return
-        await self.channel_layer.group_send(
-            schedule.channel, {"type": "playlist.update", "playlist": p.pk}
+        self.queue_send(schedule.channel, await self.playlist_update(p))
+
+    def queue_send(self, channel, message):
+        # Only the latest message per group matters, older ones are superseded
+        self.pending_sends[channel] = message
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush_sends())
+
+    async def flush_sends(self):
+        await asyncio.sleep(settings.SIGNAGE_SCHEDULER_SEND_WINDOW.total_seconds())
+        pending, self.pending_sends = self.pending_sends, dict()
+        self.flush_task = None
+        results = await asyncio.gather(
+            *(self.channel_layer.group_send(c, m) for c, m in pending.items()),
+            return_exceptions=True,
         )
+        for (channel, message), result in zip(pending.items(), results):
+            if isinstance(result, Exception):
+                logger.error(
+                    "Could not send %s to %s: %s", message.get("type"), channel, result
+                )
+
+    def sync_playlist_update(self, playlist):
+        return {
+            "type": "playlist.update",
+            "playlist": playlist.pk,
+            "payload": encode_message(playlist.get_cached_message()),
+        }
+
+    async def playlist_update(self, playlist):
+        return await self.run_sync(self.sync_playlist_update, playlist)
 
     def sync_power(self, power, after):
-        logger.debug(f"Updating power {power} after {after}")
+        logger.debug("Updating power %s after %s", power, after)
         trigger = power.get_next_trigger(after)
-        logger.debug(f"Next update for power {power} at {trigger}")
         p = power.get_active_state(after)
-        logger.debug(f"Setting power to {p} for {power}")
+        logger.debug("Setting power to %s for %s", p, power)
+        if not trigger:
+            logger.info("No more power items for %s after %s", power, after)
+            self.powers.pop(power.pk, None)
+            self.remove_job(f"power:{power.pk}")
+            return p
+        logger.debug("Next update for power %s at %s", power, trigger)
         self.powers[power.pk] = self.scheduler.add_job(
-            self.power,
+            self.fire_power,
             "date",
-            run_date=trigger.astimezone(timezone.utc),
-            kwargs={"power": power, "after": trigger},
+            run_date=trigger,
+            id=f"power:{power.pk}",
+            replace_existing=True,
+            kwargs={"pk": power.pk, "after": trigger},
         )
         return p
 
+    async def fire_power(self, pk, after):
+        for power in await self.run_sync(get_powers, {"pk": pk}):
+            await self.power(power, after)
+
     async def power(self, power, after):
-        p = await database_sync_to_async(self.sync_power)(power, after)
-        await self.channel_layer.group_send(
-            power.channel, {"type": "power.on" if p else "power.off"}
-        )
+        p = await self.run_sync(self.sync_power, power, after)
+        self.queue_send(power.channel, POWER_MESSAGES[p])
 
-    async def handle(self):
-        now = timezone.localtime()
-        schedules = await database_sync_to_async(get_model_objects)(models.Schedule)
+    def sync_bootstrap(self, now):
+        messages = []
+        schedules = get_schedules()
         for s in schedules:
-            p = await database_sync_to_async(s.get_active_playlist)(now)
-            await self.channel_layer.group_send(
-                s.channel, {"type": "playlist.update", "playlist": p.pk}
-            )
-        powers = await database_sync_to_async(get_model_objects)(models.Power)
+            p = s.get_active_playlist(now)
+            s.cache_playlist(p, until=s.get_next_trigger(now))
+            messages.append((s.channel, self.sync_playlist_update(p)))
+        powers = get_powers()
         for p in powers:
-            state = await database_sync_to_async(p.get_active_state)(now)
-            await self.channel_layer.group_send(
-                s.channel,
-                {"type": "power.on" if state else "power.off"},
-            )
+            state = p.get_active_state(now)
+            messages.append((p.channel, POWER_MESSAGES[state]))
+        return messages
+
+    async def handle(self):
+        messages = await self.run_sync(self.sync_bootstrap, timezone.localtime())
+        await asyncio.gather(
+            *(self.channel_layer.group_send(c, m) for c, m in messages)
+        )
         while True:
-            message = await self.channel_layer.receive(self.channel)
-            t = message.get("type", None)
-            if not t:
-                logger.error("Worker received message with no type.")
-                continue
+            messages = defaultdict(list)
+            for message in await self.receive_batch():
+                t = message.get("type", None)
+                if not t:
+                    logger.error("Worker received message with no type.")
+                    continue
+                if t not in self.handlers:
+                    logger.error("Worker received message with unsupported type %s.", t)
+                    continue
+                messages[t].append(message)
 
-            h = getattr(self, f"handle_{t}", None)
-            if not inspect.iscoroutinefunction(h):
-                logger.error(f"Worker received message with unsupported type {t}.")
-                continue
+            for t, batch in messages.items():
+                await self.handlers.get(t)(batch)
 
-            await h(message)
+    async def receive(self, timeout=None):
+        # Cancelling a receive can drop a message the layer already popped, so
+        # an unfinished receive is kept and awaited again on the next call.
+        if self.receive_task is None:
+            self.receive_task = asyncio.ensure_future(
+                self.channel_layer.receive(self.channel)
+            )
+        done, _ = await asyncio.wait({self.receive_task}, timeout=timeout)
+        if not done:
+            return None
+        task, self.receive_task = self.receive_task, None
+        return task.result()
 
-    async def handle_schedule(self, message):
-        pk = message.get("schedule")
-        logger.info(f"Updating schedule {pk} from channels.")
-        try:
-            schedule = models.Schedule.objects.get(pk=pk)
-        except models.Schedule.DoesNotExist:
-            logger.error("Unknown schedule {pk}")
-            return
-        if schedule.pk in self.schedules:
-            self.schedules.get(schedule.pk).remove()
-        await self.schedule(schedule, timezone.localtime())
+    async def receive_batch(self):
+        batch = [await self.receive()]
+        while len(batch) < settings.SIGNAGE_SCHEDULER_BATCH_SIZE:
+            message = await self.receive(
+                settings.SIGNAGE_SCHEDULER_BATCH_WINDOW.total_seconds()
+            )
+            if message is None:
+                break
+            batch.append(message)
+        return batch
 
-    async def handle_power(self, message):
-        pk = message.get("power")
-        logger.info(f"Updating power {pk} from channels.")
-        try:
-            power = models.Power.objects.get(pk=pk)
-        except models.Power.DoesNotExist:
-            logger.error("Unknown power {pk}")
-            return
-        if power.pk in self.powers:
-            self.powers.get(power.pk).remove()
-        await self.power(power, timezone.localtime())
+    async def handle_schedule(self, messages):
+        pks = {m.get("schedule") for m in messages}
+        logger.info("Updating schedules %s from channels.", pks)
+        schedules = await self.run_sync(get_schedules, {"pk__in": pks})
+        for pk in pks - {s.pk for s in schedules}:
+            logger.error("Unknown schedule %s", pk)
+        now = timezone.localtime()
+        for schedule in schedules:
+            await self.schedule(schedule, now)
+
+    async def handle_power(self, messages):
+        pks = {m.get("power") for m in messages}
+        logger.info("Updating powers %s from channels.", pks)
+        powers = await self.run_sync(get_powers, {"pk__in": pks})
+        for pk in pks - {p.pk for p in powers}:
+            logger.error("Unknown power %s", pk)
+        now = timezone.localtime()
+        for power in powers:
+            await self.power(power, now)
 
 
 class Command(BaseCommand):
@@ -180,6 +325,13 @@ class Command(BaseCommand):
     server_class = SignageServer
 
     def handle(self, *args, **options):
+        if settings.SIGNAGE_SCHEDULER_UVLOOP:
+            try:
+                import uvloop
+            except ImportError:
+                logger.warning("uvloop is not installed, using default event loop.")
+            else:
+                asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
         channel_layer = get_channel_layer()
         server = self.server_class(
             application=get_default_application(),
@@ -0,0 +1,20 @@
+# Generated by Django 2.2.28 on 2026-10-15 12:00
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("signage", "0011_remove_display_screen"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="scheduleitem",
+            index=django.contrib.postgres.indexes.GistIndex(
+                fields=["range"], name="signage_sch_range_3a1cf7_gist"
+            ),
+        ),
+    ]
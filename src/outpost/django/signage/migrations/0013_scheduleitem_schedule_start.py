@@ -0,0 +1,19 @@
+# Generated by Django 2.2.28 on 2026-10-15 12:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("signage", "0012_scheduleitem_range_gist"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="scheduleitem",
+            index=models.Index(
+                fields=["schedule", "start"], name="signage_sch_schedul_66548a_idx"
+            ),
+        ),
+    ]
@@ -1,23 +1,27 @@
+import asyncio
 import json
 import logging
+import os
+import shutil
 import subprocess
-from base64 import (
-    b64decode,
-    b64encode,
-)
+from base64 import b64encode
+from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import (
     datetime,
     time,
     timedelta,
 )
+from functools import (
+    cached_property,
+    lru_cache,
+)
 from hashlib import sha256
 from io import BytesIO
+from tempfile import NamedTemporaryFile
+from uuid import uuid4
 
-import asyncssh
-import fitz
 from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
 from ckeditor_uploader.fields import RichTextUploadingField
 from django.conf import settings
 from django.contrib.gis.db import models
@@ -25,10 +29,13 @@ from django.contrib.postgres.fields import (
     DateTimeRangeField,
     JSONField,
 )
+from django.contrib.postgres.indexes import GistIndex
 from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.files.base import ContentFile
 from django.core.validators import URLValidator
+from django.db import transaction
+from django.db.models import Prefetch
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
@@ -39,8 +46,8 @@ from outpost.django.base.models import NetworkedDeviceMixin
 from outpost.django.base.utils import Uuid4Upload
 from outpost.django.base.validators import ImageValidator
 from outpost.django.campusonline.models import Event as CampusOnlineEvent
+from outpost.django.restaurant.models import Meal as RestaurantMeal
 from outpost.django.weather.models import Location as WeatherLocation
-from PIL import Image
 from polymorphic.models import PolymorphicModel
 from recurrence.fields import RecurrenceField
 from shortuuid.django_fields import ShortUUIDField
@@ -55,6 +62,33 @@ from .validators import (
 logger = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=None)
+def _channel_layer():
+    from channels.layers import get_channel_layer
+
+    return get_channel_layer()
+
+
+def send_many(messages, group=False):
+    channel_layer = _channel_layer()
+    send = channel_layer.group_send if group else channel_layer.send
+
+    async def run():
+        await asyncio.gather(*(send(channel, message) for channel, message in messages))
+
+    async_to_sync(run)()
+
+
+@lru_cache(maxsize=256)
+def _fingerprint(key):
+    import asyncssh
+
+    k = asyncssh.import_private_key(key)
+    d = sha256(k.public_data).digest()
+    f = b64encode(d).replace(b"=", b"").decode("utf-8")
+    return "SHA256:{}".format(f)
+
+
 class Resolution(models.Model):
     width = models.PositiveIntegerField(null=True, blank=True)
     height = models.PositiveIntegerField(null=True, blank=True)
@@ -99,10 +133,7 @@ class Display(NetworkedDeviceMixin, models.Model):
     def fingerprint(self):
         if not self.key:
             return None
-        k = asyncssh.import_private_key(self.key.tobytes())
-        d = sha256(k.public_data).digest()
-        f = b64encode(d).replace(b"=", b"").decode("utf-8")
-        return "SHA256:{}".format(f)
+        return _fingerprint(bytes(self.key))
 
     def private_key(self):
         return self.key.tobytes().decode("ascii")
@@ -110,32 +141,108 @@ class Display(NetworkedDeviceMixin, models.Model):
     def pre_save(self, *args, **kwargs):
         if self.key:
             return
-        pk = asyncssh.generate_private_key("ssh-rsa", comment=self.name)
-        # For compatibility with older SSH implementations
-        self.key = pk.export_private_key("pkcs1-pem")
+        import asyncssh
+
+        algorithm = settings.SIGNAGE_DISPLAY_KEY_ALGORITHM
+        pk = asyncssh.generate_private_key(algorithm, comment=self.name)
+        if algorithm == "ssh-rsa":
+            # For compatibility with older SSH implementations
+            self.key = pk.export_private_key("pkcs1-pem")
+        else:
+            self.key = pk.export_private_key("openssh")
+
+    def has_screenshot(self):
+        return cache.has_key(settings.SIGNAGE_DISPLAY_SCREEN_KEY.format(self=self))
 
     @property
-    def screenshot(self):
-        if (screen := cache.get(settings.SIGNAGE_DISPLAY_SCREEN_KEY.format(self=self))):
-            return Image.open(BytesIO(b64decode(screen)))
+    def screenshot_bytes(self):
+        entry = cache.get(settings.SIGNAGE_DISPLAY_SCREEN_KEY.format(self=self))
+        if isinstance(entry, dict):
+            return entry.get("format"), entry.get("bytes")
 
-    @screenshot.setter
-    def screenshot(self, value):
-        if not isinstance(value, Image.Image):
-            raise ValueError(f"Value {value} is not of type {Image.Image}")
-        buffered = BytesIO()
-        value.save(buffered, format=value.format)
+    @property
+    def screenshot_thumbnail_bytes(self):
+        from PIL import Image
+
+        token_key = settings.SIGNAGE_DISPLAY_SCREEN_TOKEN_KEY.format(self=self)
+        thumbnail_key = settings.SIGNAGE_DISPLAY_SCREEN_THUMBNAIL_KEY.format(self=self)
+        entries = cache.get_many([token_key, thumbnail_key])
+        if (token := entries.get(token_key)) is None:
+            return None
+        entry = entries.get(thumbnail_key)
+        if isinstance(entry, dict) and entry.get("token") == token:
+            return entry.get("format"), entry.get("bytes")
+        if not (screen := self.screenshot_bytes):
+            return None
+        size = settings.SIGNAGE_DISPLAY_SCREEN_THUMBNAIL_SIZE
+        try:
+            thumbnail = Image.open(BytesIO(screen[1]))
+            # Lets JPEG decoders scale down while decoding
+            thumbnail.draft("RGB", size)
+            thumbnail.thumbnail(size, Image.LANCZOS)
+            buffered = BytesIO()
+            thumbnail.convert("RGB").save(
+                buffered,
+                format="JPEG",
+                quality=settings.SIGNAGE_DISPLAY_SCREEN_THUMBNAIL_QUALITY,
+                optimize=True,
+            )
+        except OSError:
+            logger.warning("Could not create thumbnail for screenshot of %s", self)
+            return None
         cache.set(
-            settings.SIGNAGE_DISPLAY_SCREEN_KEY.format(self=self),
-            b64encode(buffered.getvalue()),
+            thumbnail_key,
+            {"format": "JPEG", "bytes": buffered.getvalue(), "token": token},
             settings.SIGNAGE_DISPLAY_SCREEN_LIFETIME.total_seconds(),
         )
+        return "JPEG", buffered.getvalue()
+
+    @property
+    def screenshot(self):
+        from PIL import Image
+
+        if (entry := self.screenshot_bytes):
+            return Image.open(BytesIO(entry[1]))
+
+    @screenshot.setter
+    def screenshot(self, value):
+        from PIL import Image
+
+        if isinstance(value, Image.Image):
+            buffered = BytesIO()
+            value.save(buffered, format=value.format)
+            self.cache_screenshot(buffered.getvalue(), value.format)
+            return
+        if not isinstance(value, bytes):
+            raise ValueError(f"Value {value} is not of type {Image.Image} or bytes")
+        self.cache_screenshot(value, Image.open(BytesIO(value)).format)
 
     @screenshot.deleter
     def screenshot(self):
-        cache.delete(settings.SIGNAGE_DISPLAY_SCREEN_KEY.format(self=self))
+        cache.delete_many(
+            [
+                settings.SIGNAGE_DISPLAY_SCREEN_KEY.format(self=self),
+                settings.SIGNAGE_DISPLAY_SCREEN_TOKEN_KEY.format(self=self),
+                settings.SIGNAGE_DISPLAY_SCREEN_THUMBNAIL_KEY.format(self=self),
+            ]
+        )
+
+    def cache_screenshot(self, data, format):
+        # The token ties a lazily created thumbnail to this exact screenshot
+        token = uuid4().hex
+        cache.set_many(
+            {
+                settings.SIGNAGE_DISPLAY_SCREEN_KEY.format(self=self): {
+                    "format": format,
+                    "bytes": data,
+                },
+                settings.SIGNAGE_DISPLAY_SCREEN_TOKEN_KEY.format(self=self): token,
+            },
+            settings.SIGNAGE_DISPLAY_SCREEN_LIFETIME.total_seconds(),
+        )
 
 
+@signal_connect
 class Page(TimeStampedModel, PolymorphicModel):
     name = models.CharField(
         max_length=128,
@@ -167,6 +274,24 @@ class Page(TimeStampedModel, PolymorphicModel):
         return self.get_real_instance().get_message()
 
     @property
+    def message_key(self):
+        return settings.SIGNAGE_PAGE_MESSAGE_KEY.format(self=self)
+
+    def invalidate_message(self):
+        cache.delete(self.message_key)
+
+    def invalidate_playlists(self):
+        for playlist in Playlist.objects.filter(playlistitem__page=self).distinct():
+            playlist.invalidate_message()
+
+    def post_save(self, *args, **kwargs):
+        self.invalidate_playlists()
+
+    def pre_delete(self, *args, **kwargs):
+        # Playlist items are gone by post_delete, so resolve playlists up front
+        self.invalidate_playlists()
+
+    @cached_property
     def page(self):
         real = self.get_real_instance_class()
         if not real:
@@ -174,6 +299,7 @@ class Page(TimeStampedModel, PolymorphicModel):
         return real.__name__.removesuffix("Page")
 
 
+@signal_connect
 class WeatherPage(Page):
     location = models.ForeignKey(WeatherLocation, on_delete=models.CASCADE)
 
@@ -191,6 +317,7 @@ class WeatherPage(Page):
         )
 
 
+@signal_connect
 class HTMLPage(Page):
     content = models.TextField(
         help_text=_("Raw HTML can be used to construct more in-depth pages."),
@@ -210,6 +337,7 @@ class HTMLPage(Page):
         )
 
 
+@signal_connect
 class RichTextPage(Page):
     content = RichTextUploadingField()
 
@@ -306,6 +434,7 @@ class VideoPage(Page):
         )
 
 
+@signal_connect
 class WebsitePage(Page):
     url = models.URLField(
         validators=(URLValidator(schemes=("https",)),),
@@ -326,6 +455,49 @@ class WebsitePage(Page):
         )
 
 
+@contextmanager
+def local_path(field):
+    try:
+        path = field.path
+    except NotImplementedError:
+        path = None
+    if path:
+        yield path
+        return
+    # Storage has no local filesystem path, spool to a temporary file
+    with NamedTemporaryFile(suffix=os.path.splitext(field.name)[1]) as tmp:
+        with field.open("rb") as f:
+            shutil.copyfileobj(f, tmp, 1 << 20)
+        tmp.flush()
+        yield tmp.name
+
+
+@lru_cache(maxsize=None)
+def pdf_page_zoom(width, height):
+    return max(
+        settings.SIGNAGE_PDF_RENDER_MIN_HEIGHT / height,
+        settings.SIGNAGE_PDF_RENDER_MIN_WIDTH / width,
+        1,
+    )
+
+
+def render_pdf_page(page):
+    import fitz
+
+    zoom = pdf_page_zoom(page.rect.width, page.rect.height)
+    pix = page.getPixmap(matrix=fitz.Matrix(zoom, zoom))
+    if settings.SIGNAGE_PDF_RENDER_FORMAT == "png":
+        return pix.getPNGData()
+    buffered = BytesIO()
+    pix.pillowWrite(
+        buffered,
+        format=settings.SIGNAGE_PDF_RENDER_FORMAT,
+        optimize=True,
+        quality=settings.SIGNAGE_PDF_RENDER_QUALITY,
+    )
+    return buffered.getvalue()
+
+
 @signal_connect
 class PDFPage(Page):
     pdf = models.FileField(
@@ -347,30 +519,37 @@ class PDFPage(Page):
         return f"{self.name} ({self.pdf.name})"
 
     def post_save(self, *args, **kwargs):
+        from .tasks import PDFPageTask
+
+        PDFPageRender.objects.filter(pdf=self).delete()
+        super().post_save(*args, **kwargs)
+        transaction.on_commit(lambda: PDFPageTask.render.delay(self.pk))
+
+    def reset_renders(self):
+        import fitz
+
         PDFPageRender.objects.filter(pdf=self).delete()
-        with self.pdf.open() as pdf:
-            with fitz.Document(stream=pdf.read(), filetype="PDF") as doc:
-                for page in doc.pages():
-                    print(f"Rendering page {page.number} for {self.pk}")
-                    zoom = max(
-                        (settings.SIGNAGE_PDF_RENDER_MIN_HEIGHT / page.rect.height),
-                        (settings.SIGNAGE_PDF_RENDER_MIN_WIDTH / page.rect.width),
-                    )
-                    pix = page.getPixmap(
-                        matrix=fitz.Matrix(zoom, zoom) if zoom > 1 else None
-                    )
-                    c = ContentFile(
-                        b"",
-                        name=f"pdf-{self.pk}-page-{page.number}.{settings.SIGNAGE_PDF_RENDER_FORMAT}",
-                    )
-                    pix.pillowWrite(
-                        c,
-                        format=settings.SIGNAGE_PDF_RENDER_FORMAT,
-                        optimize=True,
-                        quality=settings.SIGNAGE_PDF_RENDER_QUALITY,
-                    )
-                    PDFPageRender.objects.create(pdf=self, page=page.number, image=c)
-                    c.close()
+        with local_path(self.pdf) as path, fitz.Document(path) as doc:
+            return len(doc)
+
+    def render_page(self, number):
+        import fitz
+
+        with local_path(self.pdf) as path, fitz.Document(path) as doc:
+            image = render_pdf_page(doc[number])
+        logger.debug("Rendered page %s for %s", number, self.pk)
+        # Overlapping render runs for the same file must not duplicate pages
+        PDFPageRender.objects.filter(pdf=self, page=number).delete()
+        PDFPageRender.objects.create(
+            pdf=self,
+            page=number,
+            image=ContentFile(
+                image,
+                name=f"pdf-{self.pk}-page-{number}.{settings.SIGNAGE_PDF_RENDER_FORMAT}",
+            ),
+        )
+        self.invalidate_message()
+        self.invalidate_playlists()
 
     def get_runtime(self):
         if self.page_runtime:
@@ -378,17 +557,22 @@ class PDFPage(Page):
         return super().get_runtime()
 
     def get_message(self):
-        pages = self.pdfpagerender_set.all().order_by("page")
+        pages = [p.image.url for p in self.pdfpagerender_set.order_by("page")]
+        if self.page_runtime:
+            runtime = len(pages) * self.page_runtime
+            page_runtime = int(self.page_runtime.total_seconds())
+        else:
+            runtime = super().get_runtime()
+            # Renders are still pending right after the PDF was replaced
+            page_runtime = runtime / len(pages) if pages else runtime
         return schemas.PDFPageSchema(
             page=self.page,
             id=self.pk,
             name=self.name,
-            runtime=self.get_runtime(),
+            runtime=runtime,
             url=self.pdf.url,
-            pages=[p.image.url for p in pages],
-            page_runtime=int(self.page_runtime.total_seconds())
-            if self.page_runtime
-            else self.get_runtime() / pages.count(),
+            pages=pages,
+            page_runtime=page_runtime,
         )
 
 
@@ -404,6 +588,7 @@ class PDFPageRender(models.Model):
         self.image.delete()
 
 
+@signal_connect
 class CampusOnlineEventPage(Page):
     building = models.ForeignKey(
         "campusonline.Building",
@@ -430,11 +615,14 @@ class CampusOnlineEventPage(Page):
                     title=i.title,
                     category=i.category,
                 )
-                for i in CampusOnlineEvent.objects.filter(building=self.building)
+                for i in CampusOnlineEvent.objects.filter(
+                    building=self.building
+                ).select_related("room")
             ],
         )
 
 
+@signal_connect
 class LiveChannelPage(Page):
     livechannel = models.ForeignKey(
         "video.LiveChannel",
@@ -458,6 +646,7 @@ class LiveChannelPage(Page):
         )
 
 
+@signal_connect
 class TYPO3NewsPage(Page):
     news = models.ForeignKey(
         "typo3.News", on_delete=models.DO_NOTHING, db_constraint=False
@@ -487,12 +676,13 @@ class TYPO3NewsPage(Page):
                     alternative=m.alternative,
                     preview=m.preview,
                 )
-                for m in self.news.media.all()
+                for m in self.news.media.select_related("media")
             ],
             author=self.news.author,
         )
 
 
+@signal_connect
 class TYPO3EventPage(Page):
     event = models.ForeignKey(
         "typo3.Event", on_delete=models.DO_NOTHING, db_constraint=False
@@ -526,7 +716,7 @@ class TYPO3EventPage(Page):
                     alternative=m.alternative,
                     preview=m.preview,
                 )
-                for m in self.event.media.all()
+                for m in self.event.media.select_related("media")
             ],
             location=self.event.location,
             organizer=self.event.organizer,
@@ -534,6 +724,7 @@ class TYPO3EventPage(Page):
         )
 
 
+@signal_connect
 class RestaurantPage(Page):
     restaurants = models.ManyToManyField("restaurant.Restaurant")
     restaurant_runtime = models.DurationField(default=timedelta(seconds=30))
@@ -543,12 +734,13 @@ class RestaurantPage(Page):
         verbose_name_plural = _("Restaurant pages")
 
     def get_runtime(self):
-        if self.restaurants.exists() and self.restaurant_runtime:
-            return self.restaurants.count() * self.restaurant_runtime
+        if self.restaurant_runtime and (count := self.restaurants.count()):
+            return count * self.restaurant_runtime
         return self.runtime
 
     def get_message(self):
         today = timezone.now().today()
+        meals = RestaurantMeal.objects.filter(available=today).select_related("diet")
         return schemas.RestaurantPageSchema(
             page=self.page,
             id=self.pk,
@@ -570,10 +762,12 @@ class RestaurantPage(Page):
                         schemas.Meal(
                             description=m.description, price=m.price, diet=m.diet.name
                         )
-                        for m in r.meals.filter(available=today)
+                        for m in r.meals.all()
                     ],
                 )
-                for r in self.restaurants.filter(enabled=True)
+                for r in self.restaurants.filter(enabled=True).prefetch_related(
+                    Prefetch("meals", queryset=meals)
+                )
             ],
         )
 
@@ -585,14 +779,42 @@ class Playlist(models.Model):
         return self.name
 
     def get_message(self):
+        pages = [
+            p.page
+            for p in self.playlistitem_set.filter(enabled=True).select_related("page")
+        ]
+        keys = {p.pk: p.message_key for p in pages}
+        messages = cache.get_many(keys.values())
+        if (missing := {pk for pk, key in keys.items() if key not in messages}):
+            # The polymorphic manager loads concrete pages with one query per type
+            fresh = {
+                keys[p.pk]: p.get_message() for p in Page.objects.filter(pk__in=missing)
+            }
+            cache.set_many(
+                fresh, settings.SIGNAGE_PAGE_MESSAGE_LIFETIME.total_seconds()
+            )
+            messages.update(fresh)
         return schemas.PlaylistMessage(
             id=self.pk,
-            pages=[
-                p.page.get_message() for p in self.playlistitem_set.filter(enabled=True)
-            ],
+            pages=[messages[keys[p.pk]] for p in pages],
         )
 
+    def get_cached_message(self):
+        key = settings.SIGNAGE_PLAYLIST_MESSAGE_KEY.format(self=self)
+        if (message := cache.get(key)) is None:
+            message = self.get_message().dict()
+            cache.set(
+                key,
+                message,
+                settings.SIGNAGE_PLAYLIST_MESSAGE_LIFETIME.total_seconds(),
+            )
+        return message
 
+    def invalidate_message(self):
+        cache.delete(settings.SIGNAGE_PLAYLIST_MESSAGE_KEY.format(self=self))
+
+
+@signal_connect
 class PlaylistItem(OrderedModel):
     playlist = models.ForeignKey(Playlist, on_delete=models.CASCADE)
     page = models.ForeignKey(
@@ -611,6 +833,12 @@ class PlaylistItem(OrderedModel):
     def __str__(self):
         return f"{self.page}@{self.playlist}[{self.order}]"
 
+    def post_save(self, *args, **kwargs):
+        self.playlist.invalidate_message()
+
+    def post_delete(self, *args, **kwargs):
+        self.playlist.invalidate_message()
+
 
 @signal_connect
 class ScheduleItem(models.Model):
@@ -644,6 +872,12 @@ class ScheduleItem(models.Model):
         ),
     )
 
+    class Meta:
+        indexes = (
+            GistIndex(fields=("range",)),
+            models.Index(fields=("schedule", "start")),
+        )
+
     def __str__(self):
         return f"{self.playlist} ({self.start} - {self.stop})"
 
@@ -653,6 +887,12 @@ class ScheduleItem(models.Model):
                 _("Start time must be less then end"),
             )
 
+    def post_save(self, *args, **kwargs):
+        self.schedule.invalidate_playlist()
+
+    def post_delete(self, *args, **kwargs):
+        self.schedule.invalidate_playlist()
+
 
 @dataclass
 class TriggerCandidate:
@@ -660,6 +900,7 @@ class TriggerCandidate:
     end: datetime
 
 
+@signal_connect
 class Schedule(models.Model):
     name = models.CharField(max_length=128, blank=False, null=False)
     default = models.ForeignKey(
@@ -673,54 +914,96 @@ class Schedule(models.Model):
     def __str__(self):
         return self.name
 
+    def post_save(self, *args, **kwargs):
+        self.invalidate_playlist()
+
     @property
     def channel(self):
         return f"{__name__}.{self.__class__.__name__}.{self.pk}"
 
+    def get_cached_playlist(self, now):
+        pk = cache.get(settings.SIGNAGE_SCHEDULE_PLAYLIST_KEY.format(self=self))
+        if pk is not None:
+            try:
+                return Playlist.objects.get(pk=pk)
+            except Playlist.DoesNotExist:
+                pass
+        return self.get_active_playlist(now)
+
+    def cache_playlist(self, playlist, until=None):
+        timeout = settings.SIGNAGE_SCHEDULE_PLAYLIST_LIFETIME.total_seconds()
+        if until:
+            timeout = min(timeout, (until - timezone.now()).total_seconds())
+        cache.set(
+            settings.SIGNAGE_SCHEDULE_PLAYLIST_KEY.format(self=self),
+            playlist.pk,
+            timeout,
+        )
+
+    def invalidate_playlist(self):
+        cache.delete(settings.SIGNAGE_SCHEDULE_PLAYLIST_KEY.format(self=self))
+
     def get_active_playlist(self, now):
         tz = timezone.get_current_timezone()
         dt = now.astimezone(tz)
-        scheduleitems = self.scheduleitem_set.filter(
-            range__contains=dt, stop__gt=dt.time()
-        ).order_by("start", "stop")
-        today = timezone.get_current_timezone().localize(
-            timezone.datetime.combine(now.date(), time())
-        )
+        t = dt.time()
+        if "scheduleitem_set" in getattr(self, "_prefetched_objects_cache", {}):
+            scheduleitems = sorted(
+                (
+                    s
+                    for s in self.scheduleitem_set.all()
+                    if dt in s.range and s.start <= t < s.stop
+                ),
+                key=lambda s: (s.start, s.stop),
+            )
+        else:
+            scheduleitems = self.scheduleitem_set.filter(
+                range__contains=dt, start__lte=t, stop__gt=t
+            ).order_by("start", "stop")
+        today = tz.localize(datetime.combine(now.date(), time()))
         for s in scheduleitems:
-            if bool(s.recurrences.between(today, today, dtstart=today, inc=True)):
-                if s.start <= dt.time():
-                    return s.playlist
+            if s.recurrences.between(today, today, dtstart=today, inc=True):
+                return s.playlist
         return self.default
 
     def get_next_trigger(self, after):
         tz = timezone.get_current_timezone()
-        scheduleitems = self.scheduleitem_set.filter(
-            range__endswith__gt=after
-        ).order_by("-start")
-        today = tz.localize(timezone.datetime.combine(after.date(), time()))
+        if "scheduleitem_set" in getattr(self, "_prefetched_objects_cache", {}):
+            scheduleitems = sorted(
+                (
+                    s
+                    for s in self.scheduleitem_set.all()
+                    if s.range.upper is not None and s.range.upper > after
+                ),
+                key=lambda s: s.start,
+                reverse=True,
+            )
+        else:
+            scheduleitems = self.scheduleitem_set.filter(
+                range__endswith__gt=after
+            ).order_by("-start")
+        localize = tz.localize
+        combine = datetime.combine
+        t = after.time()
+        today = localize(combine(after.date(), time()))
         candidates = [
             TriggerCandidate(
-                tz.localize(timezone.datetime.combine(r.date(), s.start)),
-                tz.localize(timezone.datetime.combine(r.date(), s.stop)),
+                localize(combine(r.date(), s.start)),
+                localize(combine(r.date(), s.stop)),
             )
             for s, r in (
                 (
                     s,
                     s.recurrences.after(
                         today,
-                        inc=s.stop > after.time(),
+                        inc=s.stop > t,
                         dtstart=today,
                         dtend=s.range.upper,
                     ),
                 )
                 for s in scheduleitems
-                if s.recurrences.after(
-                    today,
-                    inc=s.stop > after.time(),
-                    dtstart=today,
-                    dtend=s.range.upper,
-                )
             )
+            if r
         ]
         if not candidates:
             logger.debug("There are no future scheduled items, ")
@@ -734,12 +1017,20 @@ class Schedule(models.Model):
             return candidate.start
 
     def publish(self):
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.send)(
+        async_to_sync(_channel_layer().send)(
             settings.SIGNAGE_SCHEDULER_CHANNEL,
             {"type": "schedule", "schedule": self.pk},
         )
 
+    @classmethod
+    def bulk_publish(cls, queryset):
+        pks = list(queryset.order_by().values_list("pk", flat=True))
+        send_many(
+            (settings.SIGNAGE_SCHEDULER_CHANNEL, {"type": "schedule", "schedule": pk})
+            for pk in pks
+        )
+        return len(pks)
+
 
 @signal_connect
 class Power(models.Model):
@@ -752,13 +1043,20 @@ class Power(models.Model):
     def channel(self):
         return f"{__name__}.{self.__class__.__name__}.{self.pk}"
 
-    def get_active_state(self, now):
-        logger.info(f"Getting active power state for {self} at {now}")
-        dt = now.astimezone(timezone.localtime().tzinfo)
-        poweritems = self.poweritem_set.filter(on__lte=dt.time(), off__gt=dt.time())
-        today = timezone.get_current_timezone().localize(
-            timezone.datetime.combine(dt.date(), time())
-        )
+    def get_active_state(self, now, poweritems=None):
+        logger.info("Getting active power state for %s at %s", self, now)
+        tz = timezone.get_current_timezone()
+        dt = now.astimezone(tz)
+        t = dt.time()
+        if poweritems is None and "poweritem_set" in getattr(
+            self, "_prefetched_objects_cache", {}
+        ):
+            poweritems = self.poweritem_set.all()
+        if poweritems is not None:
+            poweritems = [p for p in poweritems if p.on <= t < p.off]
+        else:
+            poweritems = self.poweritem_set.filter(on__lte=t, off__gt=t)
+        today = tz.localize(datetime.combine(dt.date(), time()))
         for p in poweritems:
             if bool(p.recurrences.between(today, today, dtstart=today, inc=True)):
                 return True
@@ -768,28 +1066,27 @@ class Power(models.Model):
         tz = timezone.get_current_timezone()
         dt = after.astimezone(tz)
         poweritems = self.poweritem_set.all()
-        today = tz.localize(timezone.datetime.combine(dt.date(), time()))
+        localize = tz.localize
+        combine = datetime.combine
+        t = after.time()
+        today = localize(combine(dt.date(), time()))
         candidates = [
             TriggerCandidate(
-                tz.localize(timezone.datetime.combine(r.date(), s.on)),
-                tz.localize(timezone.datetime.combine(r.date(), s.off)),
+                localize(combine(r.date(), s.on)),
+                localize(combine(r.date(), s.off)),
             )
             for s, r in (
                 (
                     s,
                     s.recurrences.after(
                         today,
-                        inc=s.off > after.time(),
+                        inc=s.off > t,
                         dtstart=today,
                     ),
                 )
                 for s in poweritems
-                if s.recurrences.after(
-                    today,
-                    inc=s.off > after.time(),
-                    dtstart=today,
-                )
             )
+            if r
         ]
         if not candidates:
             logger.debug("There are no future power items, ")
@@ -803,11 +1100,19 @@ class Power(models.Model):
             return candidate.start
 
     def publish(self):
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.send)(
+        async_to_sync(_channel_layer().send)(
             settings.SIGNAGE_SCHEDULER_CHANNEL, {"type": "power", "power": self.pk}
         )
 
+    @classmethod
+    def bulk_publish(cls, queryset):
+        pks = list(queryset.order_by().values_list("pk", flat=True))
+        send_many(
+            (settings.SIGNAGE_SCHEDULER_CHANNEL, {"type": "power", "power": pk})
+            for pk in pks
+        )
+        return len(pks)
+
 
 class PowerItem(models.Model):
     power = models.ForeignKey("Power", on_delete=models.CASCADE)
@@ -2,7 +2,10 @@ import logging
 from datetime import timedelta
 
 import isodate
-from celery import shared_task
+from celery import (
+    group,
+    shared_task,
+)
 from django.utils import timezone
 
 from . import models
@@ -18,3 +21,30 @@ class ScheduleTask:
             range__fully_lt=threshold
         ):
             si.delete()
+
+
+class PDFPageTask:
+    @shared_task(bind=True, ignore_result=True, name=f"{__name__}.PDFPage:render")
+    def render(task, pk: int) -> None:
+        try:
+            page = models.PDFPage.objects.get(pk=pk)
+        except models.PDFPage.DoesNotExist:
+            logger.warning("PDF page %s no longer exists", pk)
+            return
+        pages = page.reset_renders()
+        group(
+            PDFPageTask.render_page.s(pk, page.pdf.name, number)
+            for number in range(pages)
+        ).delay()
+
+    @shared_task(bind=True, ignore_result=True, name=f"{__name__}.PDFPage:render_page")
+    def render_page(task, pk: int, name: str, number: int) -> None:
+        try:
+            page = models.PDFPage.objects.get(pk=pk)
+        except models.PDFPage.DoesNotExist:
+            logger.warning("PDF page %s no longer exists", pk)
+            return
+        if page.pdf.name != name:
+            logger.info("PDF of page %s was replaced, skipping page %s", pk, number)
+            return
+        page.render_page(number)
@@ -17,4 +17,9 @@ urlpatterns = [
         views.DisplayScreenshotView.as_view(),
         name="display-screenshot",
     ),
+    path(
+        "display/<str:pk>/screenshot/thumbnail",
+        views.DisplayScreenshotView.as_view(thumbnail=True),
+        name="display-screenshot-thumbnail",
+    ),
 ]
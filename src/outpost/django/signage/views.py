@@ -19,7 +19,6 @@ from django.views import View
 from django.views.generic import DetailView
 from django_ical.views import ICalFeed
 from outpost.django.video.models import LiveEvent
-from PIL import Image
 from pydantic.main import ModelMetaclass
 
 from . import (
@@ -104,11 +103,18 @@ class LiveChannelPageView(JSONResponseMixin, DetailView):
 
 class DisplayScreenshotView(LoginRequiredMixin, DetailView):
     model = models.Display
+    thumbnail = False
 
     def get(self, request, pk, *args, **kwargs):
-        screen = self.get_object().screenshot
-        if not screen:
-            screen = Image.open(finders.find("signage/placeholder/screenshot.webp"))
-        response = HttpResponse(content_type=screen.get_format_mimetype())
-        screen.save(response, format=screen.format)
-        return response
+        display = self.get_object()
+        if self.thumbnail:
+            entry = display.screenshot_thumbnail_bytes
+        else:
+            entry = display.screenshot_bytes
+        if entry:
+            format, data = entry
+        else:
+            format = "WEBP"
+            with open(finders.find("signage/placeholder/screenshot.webp"), "rb") as f:
+                data = f.read()
+        return HttpResponse(data, content_type=f"image/{format.lower()}")
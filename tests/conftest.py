@@ -0,0 +1,45 @@
+import os
+
+import django
+from django.conf import settings
+
+
+def pytest_configure():
+    if settings.configured:
+        return
+    settings.configure(
+        DATABASES={
+            "default": {
+                "ENGINE": "django.contrib.gis.db.backends.postgis",
+                "NAME": os.environ.get("POSTGRES_DB", "outpost"),
+                "USER": os.environ.get("POSTGRES_USER", ""),
+                "PASSWORD": os.environ.get("POSTGRES_PASSWORD", ""),
+                "HOST": os.environ.get("POSTGRES_HOST", ""),
+            }
+        },
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        },
+        INSTALLED_APPS=[
+            "django.contrib.auth",
+            "django.contrib.contenttypes",
+            "django.contrib.gis",
+            "django.contrib.postgres",
+            "guardian",
+            "polymorphic",
+            "ordered_model",
+            "recurrence",
+            "ckeditor",
+            "ckeditor_uploader",
+            "outpost.django.base",
+            "outpost.django.campusonline",
+            "outpost.django.typo3",
+            "outpost.django.restaurant",
+            "outpost.django.video",
+            "outpost.django.weather",
+            "outpost.django.signage",
+        ],
+        USE_TZ=True,
+        TIME_ZONE="Europe/Vienna",
+    )
+    django.setup()
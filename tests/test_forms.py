@@ -0,0 +1,87 @@
+from datetime import (
+    datetime,
+    time,
+    timezone,
+)
+from unittest import mock
+
+import pytest
+import recurrence
+from django.forms import BaseInlineFormSet
+from psycopg2.extras import DateTimeTZRange
+
+from outpost.django.signage import (
+    forms,
+    models,
+)
+
+
+class ScheduleItemForm:
+    def __init__(self, instance):
+        self.instance = instance
+        self.errors = []
+
+    def has_changed(self):
+        return True
+
+    def add_error(self, field, error):
+        self.errors.append(error)
+
+
+def item(lower, upper, start, stop, rule):
+    return ScheduleItemForm(
+        models.ScheduleItem(
+            range=DateTimeTZRange(
+                datetime(2024, 1, lower, tzinfo=timezone.utc),
+                datetime(2024, 1, upper, tzinfo=timezone.utc),
+            ),
+            start=time(start),
+            stop=time(stop),
+            recurrences=recurrence.Recurrence(rrules=[rule]),
+        )
+    )
+
+
+def clean(*items):
+    formset = forms.ScheduleItemAdminInlineFormSet.__new__(
+        forms.ScheduleItemAdminInlineFormSet
+    )
+    formset.forms = list(items)
+    with mock.patch.object(BaseInlineFormSet, "clean"):
+        formset.clean()
+    return [bool(i.errors) for i in items]
+
+
+daily = recurrence.Rule(recurrence.DAILY)
+every_other_day = recurrence.Rule(recurrence.DAILY, interval=2)
+mondays = recurrence.Rule(recurrence.WEEKLY, byday=[recurrence.MO])
+tuesdays = recurrence.Rule(recurrence.WEEKLY, byday=[recurrence.TU])
+
+
+@pytest.mark.parametrize(
+    "items,errors",
+    [
+        # Same days and overlapping times
+        (((1, 31, 8, 10, daily), (10, 20, 9, 11, daily)), [True, False]),
+        # Same days but disjoint times
+        (((1, 31, 8, 10, daily), (10, 20, 11, 12, daily)), [False, False]),
+        # Disjoint date ranges
+        (((1, 10, 8, 10, daily), (20, 31, 8, 10, daily)), [False, False]),
+        # Disjoint weekdays
+        (((1, 31, 8, 10, mondays), (1, 31, 8, 10, tuesdays)), [False, False]),
+        # Interval rules with different range starts are evaluated from a
+        # common start, just like at runtime
+        (
+            ((1, 31, 8, 10, every_other_day), (2, 31, 8, 10, every_other_day)),
+            [True, False],
+        ),
+    ],
+)
+def test_schedule_item_overlap(items, errors):
+    assert clean(*(item(*i) for i in items)) == errors
+
+
+def test_schedule_item_overlap_reported_on_first_form():
+    first = item(10, 20, 9, 11, daily)
+    second = item(1, 31, 8, 10, daily)
+    assert clean(first, second) == [True, False]
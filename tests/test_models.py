@@ -0,0 +1,82 @@
+import pytest
+from django.core.cache import cache
+
+from outpost.django.signage import models
+from outpost.django.signage.conf import settings
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+@pytest.fixture
+def page():
+    return models.HTMLPage.objects.create(name="Page", content="<p>Old</p>")
+
+
+@pytest.fixture
+def playlist(page):
+    playlist = models.Playlist.objects.create(name="Playlist")
+    models.PlaylistItem.objects.create(playlist=playlist, page=page)
+    return playlist
+
+
+def playlist_cached(playlist):
+    return cache.has_key(settings.SIGNAGE_PLAYLIST_MESSAGE_KEY.format(self=playlist))
+
+
+def test_playlist_message_is_cached(playlist, page):
+    message = playlist.get_cached_message()
+    assert playlist_cached(playlist)
+    # Bypass signals, the cached message must be served unchanged
+    models.HTMLPage.objects.filter(pk=page.pk).update(content="<p>New</p>")
+    assert playlist.get_cached_message() == message
+
+
+def test_page_save_invalidates_playlist_message(playlist, page):
+    playlist.get_cached_message()
+    page.content = "<p>New</p>"
+    page.save()
+    assert not playlist_cached(playlist)
+    message = playlist.get_cached_message()
+    assert message["pages"][0]["content"] == "<p>New</p>"
+
+
+def test_page_delete_invalidates_playlist_message(playlist, page):
+    playlist.get_cached_message()
+    page.delete()
+    assert not playlist_cached(playlist)
+    assert playlist.get_cached_message()["pages"] == []
+
+
+def test_playlist_item_save_invalidates_playlist_message(playlist):
+    other = models.HTMLPage.objects.create(name="Other", content="<p>Other</p>")
+    playlist.get_cached_message()
+    models.PlaylistItem.objects.create(playlist=playlist, page=other)
+    assert not playlist_cached(playlist)
+    assert len(playlist.get_cached_message()["pages"]) == 2
+
+
+def test_playlist_item_delete_invalidates_playlist_message(playlist):
+    playlist.get_cached_message()
+    playlist.playlistitem_set.get().delete()
+    assert not playlist_cached(playlist)
+
+
+def test_page_message_key_tracks_revision(page):
+    key = page.message_key
+    page.content = "<p>New</p>"
+    page.save()
+    assert page.message_key != key
+
+
+def test_page_message_is_cached_per_revision(playlist, page):
+    playlist.get_message()
+    assert cache.has_key(page.message_key)
+    page.invalidate_message()
+    assert not cache.has_key(page.message_key)